@@ -2,13 +2,17 @@ import streamlit as st
 import pandas as pd
 import os
 from datetime import datetime
-import shutil
 import re
+import logging
+from functools import lru_cache
 import firebase_admin
 from firebase_admin import credentials
 from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, NotFound
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
 
 # Set page configuration
 st.set_page_config(
@@ -17,210 +21,336 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize Firebase
-def initialize_firebase():
+# Initialize Firebase once per process and share a single Firestore client
+@st.cache_resource
+def get_db():
     # Check if Firebase is already initialized
     if not firebase_admin._apps:
         # Define the absolute path to the key file
         key_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'firebase-key.json')
         
-        try:
-            # Check if the key file exists
-            if os.path.exists(key_file_path):
-                # Print debug info
-                st.sidebar.success(f"Found key file at: {key_file_path}")
-                
-                # Initialize Firebase with the key file
-                cred = credentials.Certificate(key_file_path)
-                firebase_admin.initialize_app(cred)
-                st.sidebar.success("Connected to Firebase successfully!")
-                return True
-            else:
-                st.error(f"Firebase key file not found at: {key_file_path}")
-                return False
-        except Exception as e:
-            st.error(f"Error initializing Firebase: {e}")
-            return False
-    return True
+        # Check if the key file exists (errors are not cached, so a fix is picked up on the next call)
+        if not os.path.exists(key_file_path):
+            raise FileNotFoundError(f"Firebase key file not found at: {key_file_path}")
+        
+        # Initialize Firebase with the key file
+        cred = credentials.Certificate(key_file_path)
+        firebase_admin.initialize_app(cred)
+    return firestore.client()
 
-# Function to load data from Firestore
-@st.cache_data(ttl=300)  # Cache for 5 minutes
-def load_data():
-    if not initialize_firebase():
-        return pd.DataFrame(columns=[
-            "Make", "Mode", "Model Year", "VIN", "Mileage", "VEHCLE COST", 
-            "Parts Cost", "Labour Cost", "Title State", "Status", 
-            "Cost", "Mark Up", "Price", "Market Value", "Calling", "Remark",
-            "Sold_Date", "Sold_Price"
-        ])
-    
+# Columns of the vehicles collection
+INVENTORY_COLUMNS = [
+    "Make", "Mode", "Model Year", "VIN", "Mileage", "VEHCLE COST",
+    "Parts Cost", "Labour Cost", "Title State", "Status",
+    "Cost", "Mark Up", "Price", "Market Value", "Calling", "Remark",
+    "Sold_Date", "Sold_Price"
+]
+
+# Fields read from each vehicle document (inventory columns plus audit and sale fields)
+VEHICLE_FIELDS = INVENTORY_COLUMNS + [
+    "Added_Date", "Updated_Date", "Profit", "Profit_Percentage", "Sale_Notes"
+]
+
+# Numeric columns and their dtypes, applied once when the inventory is loaded
+NUMERIC_DTYPES = {
+    "Model Year": "Int32", "Mileage": "Int64",
+    "VEHCLE COST": "float64", "Parts Cost": "float64", "Labour Cost": "float64",
+    "Cost": "float64", "Mark Up": "float64", "Price": "float64",
+    "Market Value": "float64", "Sold_Price": "float64"
+}
+
+# Low-cardinality text columns stored as categoricals for cheap equality filters
+CATEGORY_COLUMNS = ["Status", "Make", "Title State"]
+
+# Coerce columns to their declared dtypes, turning bad numeric values into NaN
+# (a column whose values don't fit its dtype falls back to float64 or object
+# rather than failing the whole load)
+def apply_dtypes(df):
+    for column, dtype in NUMERIC_DTYPES.items():
+        if column in df.columns:
+            values = pd.to_numeric(df[column], errors='coerce')
+            # Round integer columns first so a stray fractional value can't fail the cast
+            if dtype.startswith("Int"):
+                values = values.round()
+            try:
+                df[column] = values.astype(dtype)
+            except (TypeError, ValueError, OverflowError):
+                df[column] = values.astype("float64")
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            try:
+                df[column] = df[column].astype("category")
+            except TypeError:
+                pass
+    return df
+
+# Index the inventory by VIN so lookups are hash-based instead of column scans
+# (VINs aren't guaranteed unique, e.g. legacy duplicates, so look rows up with .loc[[vin]])
+def index_by_vin(df):
+    return df.set_index("VIN", drop=False).rename_axis(None)
+
+# Empty inventory with the expected columns
+def empty_inventory():
+    return index_by_vin(apply_dtypes(pd.DataFrame(columns=INVENTORY_COLUMNS)))
+
+# Version of the vehicles data, shared by all sessions and bumped after every
+# write so the loaders get a fresh cache key without clearing other caches
+@st.cache_resource
+def vehicles_version():
+    return {"value": 0}
+
+# Function to load vehicles from Firestore, filtered on Status server-side
+def query_vehicles(status_op, status):
     try:
         # Connect to Firestore
-        db = firestore.client()
-        # Get all vehicles from the collection
-        vehicles_ref = db.collection('vehicles')
+        db = get_db()
+        # Get matching vehicles from the collection, fetching only the fields the app uses
+        vehicles_ref = db.collection('vehicles').where('Status', status_op, status).select(
+            [firestore.Client.field_path(field) for field in VEHICLE_FIELDS]
+        )
         vehicles = vehicles_ref.stream()
         
-        # Convert to list of dictionaries
-        vehicles_data = []
-        for vehicle in vehicles:
-            data = vehicle.to_dict()
-            # Add document ID as a field (will be useful for updates)
-            data['document_id'] = vehicle.id
-            vehicles_data.append(data)
-        
-        # Convert to DataFrame
-        if vehicles_data:
-            df = pd.DataFrame(vehicles_data)
-            return df
-        else:
-            return pd.DataFrame(columns=[
-                "Make", "Mode", "Model Year", "VIN", "Mileage", "VEHCLE COST", 
-                "Parts Cost", "Labour Cost", "Title State", "Status", 
-                "Cost", "Mark Up", "Price", "Market Value", "Calling", "Remark",
-                "Sold_Date", "Sold_Price"
-            ])
+        # Convert to DataFrame in one pass
+        # Add document ID as a field (will be useful for updates)
+        df = pd.DataFrame.from_records(
+            ({**vehicle.to_dict(), 'document_id': vehicle.id} for vehicle in vehicles),
+            columns=VEHICLE_FIELDS + ['document_id']
+        )
+        return index_by_vin(apply_dtypes(df))
     except Exception as e:
         st.error(f"Error loading data from Firebase: {e}")
-        return pd.DataFrame(columns=[
-            "Make", "Mode", "Model Year", "VIN", "Mileage", "VEHCLE COST", 
-            "Parts Cost", "Labour Cost", "Title State", "Status", 
-            "Cost", "Mark Up", "Price", "Market Value", "Calling", "Remark",
-            "Sold_Date", "Sold_Price"
-        ])
+        return empty_inventory()
+
+# Function to load unsold vehicles (version is only part of the cache key)
+@st.cache_data(ttl=300)  # Cache for 5 minutes
+def load_inventory(version):
+    return query_vehicles('!=', 'Sold')
+
+# Function to load sold vehicles (version is only part of the cache key)
+@st.cache_data(ttl=300)  # Cache for 5 minutes
+def load_sold(version):
+    return query_vehicles('==', 'Sold')
+
+# Function to write a backup, raising if any document could not be written
+def write_backup(db, timestamp, vehicles_data):
+    backup_ref = db.collection('backups').document(timestamp)
+    
+    # Retry failed writes a few times, then record them so a partial backup
+    # isn't reported as written
+    failed_writes = []
+    def on_write_error(error, _):
+        if error.attempts < 5:
+            return True
+        failed_writes.append(error)
+        return False
+    
+    # Save to Firestore with one document per vehicle, so large inventories
+    # stay under the per-document size limit
+    bulk_writer = db.bulk_writer()
+    bulk_writer.on_write_error(on_write_error)
+    bulk_writer.set(backup_ref, {
+        'timestamp': timestamp,
+        'vehicle_count': len(vehicles_data)
+    })
+    for vehicle in vehicles_data:
+        # Key by the source document ID, since VINs aren't guaranteed unique
+        document_id = vehicle.pop('document_id', None)
+        bulk_writer.set(backup_ref.collection('vehicles').document(document_id), vehicle)
+    bulk_writer.close()
+    
+    if failed_writes:
+        raise RuntimeError(f"{len(failed_writes)} backup document(s) failed to write")
 
 # Function to create backup in Firestore
 def create_backup(df):
-    if not initialize_firebase():
-        return None
-    
     try:
         # Connect to Firestore
-        db = firestore.client()
+        db = get_db()
         
-        # Create a timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # Create a backup collection
-        backup_ref = db.collection('backups').document(timestamp)
-        
-        # Convert DataFrame to list of dictionaries (excluding document_id)
+        # Convert DataFrame to list of dictionaries (document_id is kept to key the backup documents)
         df_copy = df.copy()
-        if 'document_id' in df_copy.columns:
-            df_copy = df_copy.drop(columns=['document_id'])
+        
+        # Firestore cannot store pandas missing values, so write them as null
+        df_copy = df_copy.astype(object).where(df_copy.notna(), None)
         vehicles_data = df_copy.to_dict('records')
         
-        # Save to Firestore
-        backup_ref.set({
-            'timestamp': timestamp,
-            'vehicles': vehicles_data
-        })
+        # Create a timestamp
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
+        # Save to Firestore
+        write_backup(db, timestamp, vehicles_data)
         return timestamp
     except Exception as e:
         st.error(f"Error creating backup: {e}")
         return None
 
+# Fields earlier Edit saves wrote under underscored names instead of the real ones
+LEGACY_FIELD_NAMES = {
+    "Model_Year": "Model Year", "VEHCLE_COST": "VEHCLE COST", "Parts_Cost": "Parts Cost",
+    "Labour_Cost": "Labour Cost", "Title_State": "Title State", "Mark_Up": "Mark Up",
+    "Market_Value": "Market Value"
+}
+
+# Function to re-key vehicles added under auto-generated document IDs by their VIN,
+# folding underscored fields from earlier edits back into the real ones
+# Runs once per process; a marker document stops it repeating once it has completed
+@st.cache_resource
+def migrate_vehicle_documents():
+    db = get_db()
+    marker_ref = db.collection('meta').document('migrations')
+    marker = marker_ref.get().to_dict() or {}
+    if marker.get('vehicles_keyed_by_vin') and marker.get('legacy_fields_folded'):
+        return
+    
+    for doc in db.collection('vehicles').stream():
+        data = doc.to_dict() or {}
+        
+        # The underscored value is from the latest edit, so it wins over the real field
+        renamed = {LEGACY_FIELD_NAMES[field]: data.pop(field) for field in list(data) if field in LEGACY_FIELD_NAMES}
+        data.update(renamed)
+        
+        vin = data.get('VIN')
+        if vin and doc.id != vin:
+            # Copy to the VIN-keyed document and delete the old one atomically
+            batch = db.batch()
+            try:
+                batch.create(db.collection('vehicles').document(vin), data)
+                batch.delete(doc.reference)
+                batch.commit()
+                continue
+            except (AlreadyExists, TypeError, ValueError):
+                # Duplicate or unusable VIN: leave it under its old ID to be resolved by hand
+                logger.warning("Vehicle document %s (VIN %s) was not re-keyed", doc.id, vin)
+        
+        if renamed:
+            doc.reference.set(data)
+    
+    marker_ref.set({'vehicles_keyed_by_vin': True, 'legacy_fields_folded': True}, merge=True)
+
 # Function to add a single vehicle to Firestore
 def add_vehicle(vehicle_data):
-    if not initialize_firebase():
-        return False
-    
+    vin = vehicle_data.get('VIN')
     try:
         # Connect to Firestore
-        db = firestore.client()
-        
-        # Check if VIN already exists
-        vin = vehicle_data.get('VIN')
-        if vin:
-            existing = db.collection('vehicles').where('VIN', '==', vin).limit(1).get()
-            if len(existing) > 0:
-                st.error(f"Vehicle with VIN {vin} already exists.")
-                return False
-        
-        # Add the vehicle to Firestore
-        db.collection('vehicles').add(vehicle_data)
+        db = get_db()
+        
+        # Add the vehicle keyed by VIN (create fails if the VIN already exists)
+        db.collection('vehicles').document(vin).create(vehicle_data)
         return True
+    except AlreadyExists:
+        st.error(f"Vehicle with VIN {vin} already exists.")
+        return False
     except Exception as e:
         st.error(f"Error adding vehicle: {e}")
         return False
 
 # Function to update a vehicle in Firestore
 def update_vehicle(vin, vehicle_data):
-    if not initialize_firebase():
-        return False
-    
     try:
         # Connect to Firestore
-        db = firestore.client()
-        
-        # Find the document with this VIN
-        docs = db.collection('vehicles').where('VIN', '==', vin).limit(1).get()
-        
-        if not docs:
-            st.error(f"Vehicle with VIN {vin} not found.")
-            return False
-        
-        # Convert any field names with spaces to use Firestore's field path syntax
-        sanitized_data = {}
-        for key, value in vehicle_data.items():
-            # Replace field names with spaces to use dot notation or prevent such fields
-            sanitized_key = key.replace(" ", "_")
-            sanitized_data[sanitized_key] = value
-        
-        # Update the vehicle
-        for doc in docs:
-            doc_ref = db.collection('vehicles').document(doc.id)
-            doc_ref.update(sanitized_data)
-            return True
+        db = get_db()
         
+        # Update the vehicle (update fails if no document has this VIN)
+        db.collection('vehicles').document(vin).update(vehicle_data)
+        return True
+    except NotFound:
+        st.error(f"Vehicle with VIN {vin} not found.")
         return False
     except Exception as e:
         st.error(f"Error updating vehicle: {e}")
         return False
 
-# Function to mark a vehicle as sold
-def mark_vehicle_as_sold(vin, sold_price, sold_date=None):
-    if not initialize_firebase():
+# Function to record a sale in one transaction: mark the vehicle sold and log the sale
+# Returns None if the vehicle doesn't exist and False if it was already sold
+@firestore.transactional
+def record_sale(transaction, db, vin, sale_data):
+    doc_ref = db.collection('vehicles').document(vin)
+    snapshot = doc_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return None
+    
+    # Skip the writes if the vehicle was already sold (e.g. from a stale page)
+    if (snapshot.to_dict() or {}).get('Status') == 'Sold':
         return False
     
+    transaction.update(doc_ref, {"Status": "Sold", **sale_data})
+    transaction.set(db.collection('sales_log').document(), {
+        "VIN": vin,
+        **sale_data,
+        "Logged_Date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    })
+    return True
+
+# Function to mark a vehicle as sold
+def mark_vehicle_as_sold(vin, sold_price, sold_date=None, sale_details=None):
     try:
         # Connect to Firestore
-        db = firestore.client()
-        
-        # Find the document with this VIN
-        docs = db.collection('vehicles').where('VIN', '==', vin).limit(1).get()
-        
-        if not docs:
-            st.error(f"Vehicle with VIN {vin} not found.")
-            return False
+        db = get_db()
         
         # Use today's date if not provided
         if not sold_date:
             sold_date = datetime.now().strftime("%Y-%m-%d")
         
-        # Update the vehicle to mark as sold
-        for doc in docs:
-            doc_ref = db.collection('vehicles').document(doc.id)
-            doc_ref.update({
-                "Status": "Sold",
-                "Sold_Date": sold_date,
-                "Sold_Price": sold_price
-            })
-            return True
+        sale_data = {
+            "Sold_Date": sold_date,
+            "Sold_Price": sold_price,
+            **(sale_details or {})
+        }
         
-        return False
+        # Update the vehicle and log the sale atomically (retried on contention)
+        result = record_sale(db.transaction(), db, vin, sale_data)
+        if result is None:
+            st.error(f"Vehicle with VIN {vin} not found.")
+            return False
+        if not result:
+            st.error(f"Vehicle with VIN {vin} is already marked as sold.")
+            return False
+        return True
     except Exception as e:
         st.error(f"Error marking vehicle as sold: {e}")
         return False
 
+# VIN pattern - 17 alphanumeric characters (excluding I, O, Q)
+VIN_PATTERN = re.compile(r'^[A-HJ-NPR-Z0-9]{17}$')
+
 # Function to validate VIN
 def validate_vin(vin):
-    # Basic VIN validation - 17 alphanumeric characters (excluding I, O, Q)
-    if not vin:
+    # Basic VIN validation against the precompiled pattern
+    # (reject wrong lengths before running the regex)
+    if not vin or len(vin) != 17:
         return False
-    pattern = re.compile(r'^[A-HJ-NPR-Z0-9]{17}$')
-    return bool(pattern.match(vin))
+    return VIN_PATTERN.match(vin) is not None
+
+# Shared HTTP session so VIN lookups reuse pooled TLS connections
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount('https://', HTTPAdapter(pool_maxsize=16))
+
+# NHTSA result variables to keep, mapped to vehicle detail keys
+VIN_DETAIL_KEYS = {
+    'Make': 'make',
+    'Model': 'model',
+    'Model Year': 'year',
+    'Trim': 'trim',
+    'Engine Model': 'engine'
+}
+
+# Function to decode a VIN with the NHTSA VIN Decoder API
+# (cached since a VIN's details never change; HTTP errors raise so failures aren't cached)
+@st.cache_data(show_spinner=False, max_entries=4096)
+def decode_vin(vin):
+    # Call the NHTSA API to decode the VIN
+    url = f"https://vpic.nhtsa.dot.gov/api/vehicles/decodevin/{vin}?format=json"
+    response = HTTP_SESSION.get(url, timeout=5)
+    response.raise_for_status()
+    data = response.json()
+    
+    # Extract relevant vehicle details with one lookup per result
+    results = data.get('Results', [])
+    return {
+        VIN_DETAIL_KEYS[item['Variable']]: item.get('Value')
+        for item in results
+        if item.get('Variable') in VIN_DETAIL_KEYS
+    }
 
 # Function to fetch vehicle details from VIN
 def fetch_vehicle_details(vin):
@@ -228,65 +358,59 @@ def fetch_vehicle_details(vin):
     Get vehicle details from NHTSA VIN Decoder API
     """
     try:
-        # Call the NHTSA API to decode the VIN
-        url = f"https://vpic.nhtsa.dot.gov/api/vehicles/decodevin/{vin}?format=json"
-        response = requests.get(url)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Extract relevant vehicle details
-            results = data.get('Results', [])
-            vehicle_details = {}
-            
-            for item in results:
-                variable = item.get('Variable')
-                value = item.get('Value')
-                
-                if variable == 'Make':
-                    vehicle_details['make'] = value
-                elif variable == 'Model':
-                    vehicle_details['model'] = value
-                elif variable == 'Model Year':
-                    vehicle_details['year'] = value
-                elif variable == 'Trim':
-                    vehicle_details['trim'] = value
-                elif variable == 'Engine Model':
-                    vehicle_details['engine'] = value
-                
-            return vehicle_details
-        else:
-            return None
+        return decode_vin(vin)
+    except requests.HTTPError:
+        return None
     except Exception as e:
         st.error(f"Error fetching vehicle details: {e}")
         return None
 
+# Calculate cost, price and default market value (pure, so memoized across form reruns)
+@lru_cache(maxsize=512)
+def calculate_pricing(vehicle_cost, parts_cost, labour_cost, markup):
+    # Calculate cost and price
+    cost = vehicle_cost + parts_cost + labour_cost
+    price = cost * (1 + markup/100)
+    return cost, price, price * 1.1  # Default market value: 10% above price
+
 # Calculate market value with user input option
 def calculate_market_value(vehicle_cost, parts_cost, labour_cost, markup, manual_market_value=None):
     try:
-        vehicle_cost = float(vehicle_cost) if vehicle_cost else 0
-        parts_cost = float(parts_cost) if parts_cost else 0
-        labour_cost = float(labour_cost) if labour_cost else 0
-        markup = float(markup) if markup else 0
+        vehicle_cost = float(vehicle_cost) if vehicle_cost else 0.0
+        parts_cost = float(parts_cost) if parts_cost else 0.0
+        labour_cost = float(labour_cost) if labour_cost else 0.0
+        markup = float(markup) if markup else 0.0
         
-        # Calculate cost and price
-        cost = vehicle_cost + parts_cost + labour_cost
-        price = cost * (1 + markup/100)
+        cost, price, market_value = calculate_pricing(vehicle_cost, parts_cost, labour_cost, markup)
         
-        # Use manual market value if provided, otherwise calculate
+        # Use manual market value if provided, otherwise keep the calculated one
         if manual_market_value is not None and manual_market_value != "":
             try:
                 market_value = float(manual_market_value)
             except ValueError:
                 st.warning("Invalid market value input. Using calculated value instead.")
-                market_value = price * 1.1  # Default calculation
-        else:
-            market_value = price * 1.1  # Default: 10% above price
         
         return cost, price, market_value
     except ValueError:
         return None, None, None
 
+# Make filter options, cached across reruns until the Make column changes
+@st.cache_data
+def get_make_options(makes):
+    return ["All"] + sorted(makes.dropna().unique().tolist())
+
+# Sold vehicle statistics, cached across reruns until the sold prices, costs or markups change
+@st.cache_data
+def get_sold_stats(sold_df):
+    # Calculate total profit, dropping NaN values
+    total_profit = (sold_df["Sold_Price"].fillna(0) - sold_df["Cost"].fillna(0)).sum()
+    avg_markup = sold_df["Mark Up"].mean()
+    return total_profit, avg_markup
+
+# Column as text for selector labels (missing values become empty strings)
+def label_text(column):
+    return column.astype(str).fillna("")
+
 # Main application
 def main():
     st.title("Automotive Sales Management")
@@ -294,13 +418,24 @@ def main():
     # Sidebar navigation
     page = st.sidebar.radio("Navigation", ["View Inventory", "Sold Vehicles", "Add New Vehicle", "Edit Vehicle", "Mark as Sold"])
     
-    # Load data
-    df = load_data()
-    display_df = df.copy()
+    # Make sure every vehicle document is keyed by VIN and uses the real field names before reading or writing any
+    try:
+        migrate_vehicle_documents()
+    except Exception as e:
+        st.error(f"Error migrating vehicle documents: {e}")
+    
+    # Load data (the Add page doesn't show any, so it skips the read)
+    version = vehicles_version()["value"]
+    if page == "Add New Vehicle":
+        df = empty_inventory()
+    elif page == "Sold Vehicles":
+        df = load_sold(version)
+    else:
+        # Every other page works on unsold inventory only
+        df = load_inventory(version)
     
-    # Remove document_id from display DataFrame if it exists
-    if 'document_id' in display_df.columns:
-        display_df = display_df.drop(columns=['document_id'])
+    # Remove document_id from display DataFrame if it exists (no extra copy needed)
+    display_df = df.drop(columns=['document_id'], errors='ignore')
     
     if page == "View Inventory":
         st.header("Current Inventory")
@@ -309,27 +444,28 @@ def main():
         st.subheader("Search Filters")
         col1, col2, col3 = st.columns(3)
         
-        all_makes = ["All"] + sorted(df["Make"].dropna().unique().tolist())
+        all_makes = get_make_options(df["Make"])
         selected_make = col1.selectbox("Make", all_makes)
         
         all_statuses = ["All", "Available", "In Process", "Hold"]
         selected_status = col2.selectbox("Status", all_statuses)
         
+        # Build a single mask and apply it once
+        mask = pd.Series(True, index=display_df.index)
+        
         # Filter by Make if not "All"
-        filtered_df = display_df
         if selected_make != "All":
-            filtered_df = filtered_df[filtered_df["Make"] == selected_make]
+            mask &= display_df["Make"] == selected_make
         
         # Filter by Status if not "All"
         if selected_status != "All":
-            filtered_df = filtered_df[filtered_df["Status"] == selected_status]
+            mask &= display_df["Status"] == selected_status
         
-        # Only show non-sold vehicles in the main inventory
-        filtered_df = filtered_df[filtered_df["Status"] != "Sold"]
+        filtered_df = display_df.loc[mask]
         
         # Display data
         if not filtered_df.empty:
-            st.dataframe(filtered_df, use_container_width=True)
+            st.dataframe(filtered_df, use_container_width=True, hide_index=True)
             st.write(f"Total Vehicles: {len(filtered_df)}")
         else:
             st.info("No vehicles found with the selected filters. Add a vehicle to get started.")
@@ -337,22 +473,16 @@ def main():
     elif page == "Sold Vehicles":
         st.header("Sold Vehicles")
         
-        # Filter to show only sold vehicles
-        sold_df = display_df[display_df["Status"] == "Sold"]
+        sold_df = display_df
         
         if not sold_df.empty:
-            st.dataframe(sold_df, use_container_width=True)
+            st.dataframe(sold_df, use_container_width=True, hide_index=True)
             
             # Calculate total profit
             # Make sure columns exist and handle potential missing data
             if "Sold_Price" in sold_df.columns and "Cost" in sold_df.columns:
-                # Convert to numeric, coercing errors to NaN
-                sold_df["Sold_Price"] = pd.to_numeric(sold_df["Sold_Price"], errors='coerce')
-                sold_df["Cost"] = pd.to_numeric(sold_df["Cost"], errors='coerce')
-                
-                # Calculate total profit, dropping NaN values
-                total_profit = (sold_df["Sold_Price"].fillna(0) - sold_df["Cost"].fillna(0)).sum()
-                avg_markup = sold_df["Mark Up"].mean() if "Mark Up" in sold_df.columns else 0
+                # Pass only the columns the stats use, so the cache key hashes just those
+                total_profit, avg_markup = get_sold_stats(sold_df[["Sold_Price", "Cost", "Mark Up"]])
                 
                 # Display summary statistics
                 st.subheader("Sold Vehicle Statistics")
@@ -364,14 +494,13 @@ def main():
                 # If we have sold dates, add a chart for sales over time
                 if "Sold_Date" in sold_df.columns:
                     st.subheader("Sales Over Time")
-                    sold_df["Sold_Date"] = pd.to_datetime(sold_df["Sold_Date"], errors='coerce')
-                    if not sold_df["Sold_Date"].isna().all():
-                        # Group by month/year and count
-                        sold_df['Month'] = sold_df["Sold_Date"].dt.strftime('%Y-%m')
-                        sales_by_month = sold_df.groupby('Month').size().reset_index(name='Count')
+                    sold_dates = pd.to_datetime(sold_df["Sold_Date"], errors='coerce').dropna()
+                    if not sold_dates.empty:
+                        # Bucket sales by calendar month and count
+                        sales_by_month = sold_dates.to_frame().set_index("Sold_Date").resample('MS').size()
                         
                         # Create a bar chart
-                        st.bar_chart(sales_by_month.set_index('Month')['Count'])
+                        st.bar_chart(sales_by_month)
         else:
             st.info("No vehicles have been marked as sold yet.")
     
@@ -469,25 +598,28 @@ def main():
                     if add_vehicle(new_vehicle):
                         st.success(f"Vehicle {make} {mode} with VIN {vin} added successfully!")
                         # Refresh data
-                        st.cache_data.clear()
+                        vehicles_version()["value"] += 1
     
     elif page == "Edit Vehicle":
         st.header("Edit Vehicle")
         
-        # Filter out sold vehicles
-        edit_df = df[df["Status"] != "Sold"]
+        edit_df = df
         
         # VIN selection for editing
         if not edit_df.empty:
-            vehicles = edit_df[["Make", "Mode", "VIN"]].apply(
-                lambda x: f"{x['Make']} {x['Mode']} (VIN: {x['VIN']})", axis=1
+            vehicles = (
+                label_text(edit_df["Make"]) + " " + label_text(edit_df["Mode"])
+                + " (VIN: " + label_text(edit_df["VIN"]) + ")"
             ).tolist()
             
-            selected_vehicle = st.selectbox("Select Vehicle to Edit", vehicles)
+            # Map each label back to its VIN instead of parsing it out of the label
+            vin_by_label = dict(zip(vehicles, edit_df["VIN"]))
+            
+            selected_vehicle = st.selectbox("Select Vehicle to Edit", list(vin_by_label))
             
             if selected_vehicle:
-                vin_to_edit = selected_vehicle.split("(VIN: ")[1].split(")")[0]
-                vehicle_data = edit_df[edit_df["VIN"] == vin_to_edit].iloc[0].to_dict()
+                vin_to_edit = vin_by_label[selected_vehicle]
+                vehicle_data = edit_df.loc[[vin_to_edit]].iloc[0].to_dict()
                 
                 with st.form("edit_vehicle_form"):
                     col1, col2, col3 = st.columns(3)
@@ -498,14 +630,14 @@ def main():
                     vin = col1.text_input("VIN", value=vehicle_data.get("VIN", ""), disabled=True)
                     mileage = col1.number_input("Mileage", min_value=0, value=int(vehicle_data.get("Mileage", 0)))
                     
-                    vehicle_cost = col2.number_input("Vehicle Cost", min_value=0.0, value=float(vehicle_data.get("VEHCLE COST", 0.0)))
-                    parts_cost = col2.number_input("Parts Cost", min_value=0.0, value=float(vehicle_data.get("Parts Cost", 0.0)))
-                    labour_cost = col2.number_input("Labour Cost", min_value=0.0, value=float(vehicle_data.get("Labour Cost", 0.0)))
+                    vehicle_cost = col2.number_input("Vehicle Cost", min_value=0.0, value=vehicle_data.get("VEHCLE COST", 0.0))
+                    parts_cost = col2.number_input("Parts Cost", min_value=0.0, value=vehicle_data.get("Parts Cost", 0.0))
+                    labour_cost = col2.number_input("Labour Cost", min_value=0.0, value=vehicle_data.get("Labour Cost", 0.0))
                     title_state = col2.text_input("Title State", value=vehicle_data.get("Title State", ""))
                     status = col2.selectbox("Status", ["Available", "In Process", "Hold"], 
                                            index=["Available", "In Process", "Hold"].index(vehicle_data.get("Status", "Available")))
                     
-                    markup = col3.number_input("Mark Up (%)", min_value=0.0, value=float(vehicle_data.get("Mark Up", 10.0)))
+                    markup = col3.number_input("Mark Up (%)", min_value=0.0, value=vehicle_data.get("Mark Up", 10.0))
                     calling = col3.text_input("Calling", value=vehicle_data.get("Calling", ""))
                     remark = col3.text_area("Remark", value=vehicle_data.get("Remark", ""))
                     
@@ -560,27 +692,30 @@ def main():
                             if update_vehicle(vin, updated_vehicle):
                                 st.success(f"Vehicle {make} {mode} with VIN {vin} updated successfully!")
                                 # Refresh data
-                                st.cache_data.clear()
+                                vehicles_version()["value"] += 1
         else:
             st.info("No vehicles found to edit. Add a vehicle first.")
     
     elif page == "Mark as Sold":
         st.header("Mark Vehicle as Sold")
         
-        # Filter to show only available vehicles
-        available_df = df[df["Status"] != "Sold"]
+        available_df = df
         
         if not available_df.empty:
-            vehicles = available_df[["Make", "Mode", "VIN", "Price"]].apply(
-                lambda x: f"{x['Make']} {x['Mode']} (VIN: {x['VIN']}) - Listed: ${float(x['Price']):.2f}", 
-                axis=1
+            vehicles = (
+                label_text(available_df["Make"]) + " " + label_text(available_df["Mode"])
+                + " (VIN: " + label_text(available_df["VIN"]) + ") - Listed: $"
+                + available_df["Price"].map("{:.2f}".format)
             ).tolist()
             
-            selected_vehicle = st.selectbox("Select Vehicle to Mark as Sold", vehicles)
+            # Map each label back to its VIN instead of parsing it out of the label
+            vin_by_label = dict(zip(vehicles, available_df["VIN"]))
+            
+            selected_vehicle = st.selectbox("Select Vehicle to Mark as Sold", list(vin_by_label))
             
             if selected_vehicle:
-                vin_to_mark = selected_vehicle.split("(VIN: ")[1].split(")")[0]
-                vehicle_data = available_df[available_df["VIN"] == vin_to_mark].iloc[0].to_dict()
+                vin_to_mark = vin_by_label[selected_vehicle]
+                vehicle_data = available_df.loc[[vin_to_mark]].iloc[0].to_dict()
                 
                 with st.form("mark_sold_form"):
                     col1, col2 = st.columns(2)
@@ -592,11 +727,11 @@ def main():
                     col1.markdown(f"**VIN:** {vehicle_data.get('VIN', '')}")
                     
                     # Get listed price
-                    listed_price = float(vehicle_data.get('Price', 0))
+                    listed_price = vehicle_data.get('Price', 0)
                     col2.markdown(f"**Listed Price:** ${listed_price:.2f}")
                     
                     # Get cost
-                    cost = float(vehicle_data.get('Cost', 0))
+                    cost = vehicle_data.get('Cost', 0)
                     col2.markdown(f"**Total Cost:** ${cost:.2f}")
                     
                     # Input fields for sale
@@ -623,20 +758,17 @@ def main():
                     
                     if submitted:
                         # Prepare sale data
-                        sold_vehicle_data = {
-                            "Status": "Sold",
-                            "Sold_Price": sold_price,
-                            "Sold_Date": sold_date.strftime("%Y-%m-%d"),
+                        sale_details = {
                             "Profit": profit,
                             "Profit_Percentage": profit_percentage,
                             "Sale_Notes": sale_notes
                         }
                         
                         # Update in Firestore
-                        if update_vehicle(vin_to_mark, sold_vehicle_data):
+                        if mark_vehicle_as_sold(vin_to_mark, sold_price, sold_date.strftime("%Y-%m-%d"), sale_details):
                             st.success(f"Vehicle marked as sold for ${sold_price:.2f}!")
                             # Refresh data
-                            st.cache_data.clear()
+                            vehicles_version()["value"] += 1
         else:
             st.info("No available vehicles found to mark as sold.")
 